@@ -0,0 +1,278 @@
+import os
+import sys
+import base64
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from aiohttp import web
+from dotenv import load_dotenv
+from PIL import Image
+
+# Ajouter le chemin actuel au path Python pour assurer l'importation du module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from audio_processor import preprocess_audio, transcribe_audio
+from text_processor import extract_visual_elements, analyze_dream_sentiment, create_image_prompt
+from image_generator import generate_image_with_clipboard, create_image_variants, preview_styled_prompt
+from image_generator import get_speculative_stats
+from token_budget import get_token_stats
+from response_parser import get_parse_metrics
+from model_router import get_routing_stats
+
+# Charger les variables d'environnement
+load_dotenv()
+
+# Nombre maximal de requêtes traitées simultanément par instance (au-delà : 503)
+MAX_IN_FLIGHT = int(os.getenv("DREAM_API_MAX_IN_FLIGHT", "16"))
+# Taille du pool de processus pour le travail CPU (audio, images)
+PROCESS_WORKERS = int(os.getenv("DREAM_API_PROCESS_WORKERS", str(os.cpu_count() or 2)))
+# Routes de supervision, jamais refusées par la limite de charge
+MONITORING_PATHS = ("/health", "/metrics")
+# Taille maximale d'une requête (fichiers audio)
+MAX_REQUEST_SIZE = 25 * 1024 * 1024
+# Dimensions d'image acceptées (mêmes choix que l'interface Streamlit)
+ALLOWED_IMAGE_SIZES = (512, 768, 1024)
+
+def _preprocess_audio_bytes(audio_bytes):
+    """
+    Prétraitement audio exécuté dans le pool de processus
+    """
+    return preprocess_audio(BytesIO(audio_bytes))
+
+def _image_variants_bytes(image_bytes, width, height):
+    """
+    Production des variantes d'image exécutée dans le pool de processus
+    (seuls les octets encodés sont renvoyés au processus principal)
+    """
+    image = Image.open(BytesIO(image_bytes))
+    variants = create_image_variants(image, width, height)
+    return {key: value for key, value in variants.items() if not isinstance(value, Image.Image)}
+
+def _encode_base64(data):
+    return base64.b64encode(data).decode("ascii")
+
+def _pool_is_broken(pool):
+    # ProcessPoolExecutor n'expose son état que via l'attribut _broken
+    return bool(getattr(pool, "_broken", False))
+
+async def _run_cpu(request, func, *args):
+    """
+    Exécute une fonction CPU dans le pool de processus sans bloquer la boucle.
+    Si un worker meurt, le pool cassé est remplacé et la requête reçoit un 503.
+    """
+    app = request.app
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(app["process_pool"], func, *args)
+    except BrokenProcessPool:
+        logging.error("Pool de processus cassé, recréation")
+        if _pool_is_broken(app["process_pool"]):
+            app["process_pool"].shutdown(wait=False)
+            app["process_pool"] = _create_process_pool()
+            app["state"]["pool_restarts"] += 1
+        raise web.HTTPServiceUnavailable(
+            text="Worker interrompu, réessayez plus tard",
+            content_type="text/plain",
+            headers={"Retry-After": "1"}
+        )
+
+async def _read_json(request):
+    try:
+        return await request.json()
+    except Exception:
+        raise web.HTTPBadRequest(text="Corps JSON invalide", content_type="text/plain")
+
+@web.middleware
+async def backpressure_middleware(request, handler):
+    """
+    Refuse les requêtes au-delà de MAX_IN_FLIGHT pour que le load balancer
+    puisse les rediriger vers une autre instance
+    """
+    if request.path in MONITORING_PATHS:
+        return await handler(request)
+
+    state = request.app["state"]
+    if state["in_flight"] >= MAX_IN_FLIGHT:
+        state["rejected"] += 1
+        return web.json_response(
+            {"error": "Serveur saturé, réessayez plus tard"},
+            status=503,
+            headers={"Retry-After": "1"}
+        )
+
+    state["in_flight"] += 1
+    try:
+        return await handler(request)
+    finally:
+        state["in_flight"] -= 1
+
+async def health(request):
+    state = request.app["state"]
+    # Un pool cassé rend l'instance inutilisable : 503 pour que le load balancer la retire
+    pool_broken = _pool_is_broken(request.app["process_pool"])
+    return web.json_response({
+        "status": "degraded" if pool_broken else "ok",
+        "process_pool": "broken" if pool_broken else "ok",
+        "pool_restarts": state["pool_restarts"],
+        "in_flight": state["in_flight"],
+        "max_in_flight": MAX_IN_FLIGHT,
+        "rejected": state["rejected"],
+        "process_workers": PROCESS_WORKERS
+    }, status=503 if pool_broken else 200)
+
+async def metrics(request):
+    """
+    GET /metrics : compteurs cumulés de l'instance (tokens, parsing, routage, pré-génération)
+    """
+    return web.json_response({
+        "tokens": get_token_stats(),
+        "parsing": get_parse_metrics(),
+        "routing": get_routing_stats(),
+        "speculative": get_speculative_stats()
+    })
+
+async def transcribe(request):
+    """
+    POST /transcribe : fichier audio (multipart, champ "audio") ou octets bruts
+    """
+    if request.content_type.startswith("multipart/"):
+        form = await request.post()
+        audio_field = form.get("audio")
+        if audio_field is None or not hasattr(audio_field, "file"):
+            raise web.HTTPBadRequest(text="Champ 'audio' manquant", content_type="text/plain")
+        audio_bytes = audio_field.file.read()
+    else:
+        audio_bytes = await request.read()
+
+    if not audio_bytes:
+        raise web.HTTPBadRequest(text="Audio vide", content_type="text/plain")
+
+    audio_path = await _run_cpu(request, _preprocess_audio_bytes, audio_bytes)
+    transcript = await asyncio.to_thread(transcribe_audio, audio_path)
+
+    if isinstance(transcript, str) and transcript.startswith("Error:"):
+        return web.json_response({"error": transcript}, status=502)
+    return web.json_response({"transcript": transcript})
+
+async def analyze(request):
+    """
+    POST /analyze : {"text": "..."} -> éléments visuels et sentiment
+    """
+    payload = await _read_json(request)
+    text = payload.get("text")
+    if not text:
+        raise web.HTTPBadRequest(text="Champ 'text' manquant", content_type="text/plain")
+
+    # Les deux appels Mistral sont indépendants : les lancer en parallèle
+    visual_analysis, sentiment_analysis = await asyncio.gather(
+        asyncio.to_thread(extract_visual_elements, text),
+        asyncio.to_thread(analyze_dream_sentiment, text)
+    )
+    return web.json_response({
+        "visual_analysis": visual_analysis,
+        "sentiment_analysis": sentiment_analysis
+    })
+
+async def build_prompt(request):
+    """
+    POST /prompt : {"visual_analysis": {...}, "style": "..."} -> prompt final
+    """
+    payload = await _read_json(request)
+    visual_analysis = payload.get("visual_analysis")
+    if not isinstance(visual_analysis, dict):
+        raise web.HTTPBadRequest(text="Champ 'visual_analysis' manquant", content_type="text/plain")
+
+    style = payload.get("style", "automatic")
+    prompt_data = create_image_prompt(visual_analysis, style)
+    prompt_data["preview"] = preview_styled_prompt(prompt_data["prompt_principal"], style)
+    return web.json_response(prompt_data)
+
+async def generate(request):
+    """
+    POST /generate : {"prompt", "style", "width", "height"} -> image et variantes (base64)
+    """
+    payload = await _read_json(request)
+    prompt = payload.get("prompt")
+    if not prompt:
+        raise web.HTTPBadRequest(text="Champ 'prompt' manquant", content_type="text/plain")
+
+    style = payload.get("style", "automatic")
+    try:
+        width = int(payload["width"]) if payload.get("width") else None
+        height = int(payload["height"]) if payload.get("height") else None
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text="Dimensions invalides", content_type="text/plain")
+    # Vérifier avant l'appel payant à ClipDrop et avant toute allocation dans un worker
+    if any(size is not None and size not in ALLOWED_IMAGE_SIZES for size in (width, height)):
+        raise web.HTTPBadRequest(
+            text=f"Dimensions acceptées: {', '.join(str(size) for size in ALLOWED_IMAGE_SIZES)}",
+            content_type="text/plain"
+        )
+
+    # Octets seuls : pas de fichier temporaire ni de variantes côté thread
+    result = await asyncio.to_thread(
+        generate_image_with_clipboard, prompt, style, width, height, bytes_only=True
+    )
+    if not result["success"]:
+        return web.json_response({"error": result["error"]}, status=502)
+
+    variants = await _run_cpu(request, _image_variants_bytes, result["image_bytes"], width, height)
+
+    return web.json_response({
+        "prompt_used": result["prompt_used"],
+        "style": result["style"],
+        "content_hash": variants["content_hash"],
+        "dimensions": variants["dimensions"],
+        "png": _encode_base64(variants["png"]),
+        "webp": _encode_base64(variants["webp"]),
+        "jpeg": _encode_base64(variants["jpeg"]),
+        "thumbnail_webp": _encode_base64(variants["thumbnail_webp"])
+    })
+
+def _create_process_pool():
+    # forkserver : les workers ne sont pas forkés depuis un processus déjà multi-thread
+    # (threads asyncio.to_thread, clients HTTP Groq/Mistral) : pas de risque d'interblocage
+    return ProcessPoolExecutor(
+        max_workers=PROCESS_WORKERS,
+        mp_context=multiprocessing.get_context("forkserver")
+    )
+
+async def _start_process_pool(app):
+    app["process_pool"] = _create_process_pool()
+
+async def _stop_process_pool(app):
+    app["process_pool"].shutdown(wait=True)
+
+def create_app():
+    """
+    Construit l'application HTTP (utilisable avec web.run_app ou gunicorn)
+    """
+    app = web.Application(middlewares=[backpressure_middleware], client_max_size=MAX_REQUEST_SIZE)
+    app["state"] = {"in_flight": 0, "rejected": 0, "pool_restarts": 0}
+    app.on_startup.append(_start_process_pool)
+    app.on_cleanup.append(_stop_process_pool)
+
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_post("/transcribe", transcribe)
+    app.router.add_post("/analyze", analyze)
+    app.router.add_post("/prompt", build_prompt)
+    app.router.add_post("/generate", generate)
+    return app
+
+def main():
+    """Lance le service HTTP headless"""
+    parser = argparse.ArgumentParser(description="API HTTP du Synthétiseur de Rêves")
+    parser.add_argument("--host", default=os.getenv("DREAM_API_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("DREAM_API_PORT", "8000")))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
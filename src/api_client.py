@@ -0,0 +1,139 @@
+import os
+import time
+import base64
+import requests
+from io import BytesIO
+from concurrent.futures import Future
+from PIL import Image
+from dotenv import load_dotenv
+
+# Charger les variables d'environnement
+load_dotenv()
+
+# URL du service HTTP (voir api.py) ; si absente, l'application travaille en local
+DREAM_API_URL = os.getenv("DREAM_API_URL", "").rstrip("/")
+DREAM_API_TIMEOUT = int(os.getenv("DREAM_API_TIMEOUT", "120"))
+
+# Délai maximal respecté pour un Retry-After (secondes)
+MAX_RETRY_AFTER = 5
+
+def _post(path, **kwargs):
+    """
+    POST vers le service ; une réponse 503 (instance saturée) est retentée une fois
+    après le délai indiqué par Retry-After
+    """
+    url = f"{DREAM_API_URL}{path}"
+    response = requests.post(url, timeout=DREAM_API_TIMEOUT, **kwargs)
+    if response.status_code == 503:
+        try:
+            delay = float(response.headers.get("Retry-After", "1"))
+        except ValueError:
+            delay = 1.0
+        time.sleep(min(max(delay, 0.0), MAX_RETRY_AFTER))
+        response = requests.post(url, timeout=DREAM_API_TIMEOUT, **kwargs)
+    return response
+
+def _response_payload(response):
+    try:
+        payload = response.json()
+    except ValueError:
+        return {"error": response.text}
+    return payload if isinstance(payload, dict) else {"error": str(payload)}
+
+def _post_json(path, payload):
+    response = _post(path, json=payload)
+    return response.status_code, _response_payload(response)
+
+def _completed(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+def preprocess_audio(audio_file):
+    """
+    Côté client, le prétraitement est délégué au service : on renvoie les octets bruts
+    """
+    return audio_file.getvalue()
+
+def transcribe_audio(audio_bytes):
+    """
+    Transcrit l'audio via le service HTTP (même contrat que audio_processor.transcribe_audio :
+    toute erreur est renvoyée sous la forme "Error: ...")
+    """
+    try:
+        response = _post(
+            "/transcribe",
+            data=audio_bytes,
+            headers={"Content-Type": "application/octet-stream"}
+        )
+        payload = _response_payload(response)
+        if response.status_code != 200:
+            message = payload.get("error") or f"HTTP {response.status_code}"
+            if not message.startswith("Error:"):
+                message = f"Error: {message} (HTTP {response.status_code})"
+            return message
+        return payload["transcript"]
+    except Exception as e:
+        print(f"Error transcribing audio: {e}")
+        return f"Error: {str(e)}"
+
+def transcribe_segment(wav_bytes):
+    """
+    Transcription d'un segment pour IncrementalTranscriber
+    """
+    return transcribe_audio(wav_bytes)
+
+def analyze_dream(raw_text):
+    """
+    Analyse visuelle et émotionnelle en un seul appel au service
+
+    Returns:
+        tuple: (visual_analysis, sentiment_analysis)
+    """
+    status, payload = _post_json("/analyze", {"text": raw_text})
+    if status != 200:
+        raise RuntimeError(f"Erreur API ({status}): {payload}")
+    return payload["visual_analysis"], payload["sentiment_analysis"]
+
+def generate_image_with_clipboard(prompt, style="automatic", width=None, height=None):
+    """
+    Génère l'image via le service (même contrat que image_generator.generate_image_with_clipboard)
+    """
+    try:
+        status, payload = _post_json("/generate", {
+            "prompt": prompt,
+            "style": style,
+            "width": width,
+            "height": height
+        })
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"Erreur lors de la génération: {str(e)}"
+        }
+
+    if status != 200:
+        return {
+            "success": False,
+            "error": payload.get("error", f"Erreur API: {status}")
+        }
+
+    # Les variantes sont déjà calculées par le service : même structure que
+    # image_generator.submit_image_variants, avec des Futures déjà résolus
+    variants = {
+        "content_hash": payload["content_hash"],
+        "dimensions": payload["dimensions"]
+    }
+    for key in ("png", "webp", "jpeg", "thumbnail_webp"):
+        variants[key] = _completed(base64.b64decode(payload[key]))
+    requested = Image.open(BytesIO(variants["png"].result()))
+    variants["requested"] = _completed(requested)
+
+    return {
+        "success": True,
+        "image_path": None,
+        "image": requested,
+        "variants": variants,
+        "prompt_used": payload["prompt_used"],
+        "style": payload["style"]
+    }
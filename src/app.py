@@ -1,7 +1,6 @@
 import streamlit as st
 import os
 import sys
-import tempfile
 from io import BytesIO
 from dotenv import load_dotenv
 
@@ -17,9 +16,13 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # Importer les fonctions des modules
 try:
-    from audio_processor import preprocess_audio, transcribe_audio
+    from audio_processor import preprocess_audio, transcribe_audio, IncrementalTranscriber
     from text_processor import extract_visual_elements, analyze_dream_sentiment, create_image_prompt
     from image_generator import generate_image_with_clipboard, get_available_styles, preview_styled_prompt
+    from image_generator import start_speculative_generation, claim_speculative_generation, discard_speculative_generation, get_speculative_stats
+    from token_budget import get_token_stats
+    from response_parser import get_parse_metrics
+    from model_router import get_routing_stats
     import_success = True
 except ImportError as e:
     import_success = False
@@ -28,6 +31,18 @@ except ImportError as e:
 # Charger les variables d'environnement
 load_dotenv()
 
+# Mode client léger : si DREAM_API_URL est défini, le pipeline est délégué au service HTTP (api.py)
+api_client = None
+if import_success and os.getenv("DREAM_API_URL"):
+    import api_client
+    preprocess_audio = api_client.preprocess_audio
+    transcribe_audio = api_client.transcribe_audio
+    generate_image_with_clipboard = api_client.generate_image_with_clipboard
+
+# Génération spéculative : style et dimensions proposés par défaut dans la section 4
+SPECULATIVE_STYLE = "automatic"
+SPECULATIVE_IMAGE_SIZE = 1024
+
 # Set page config
 st.set_page_config(
     page_title="Dream Synthesizer",
@@ -65,32 +80,79 @@ with tab2:
     st.info("💡 Cliquez sur 'Enregistrer' puis parlez. Cliquez sur 'Arrêter' quand vous avez terminé.")
     
     if audio_recorder_available:
+        # Mode segmenté : chaque segment est transcrit pendant que l'utilisateur continue
+        live_mode = st.checkbox(
+            "⚡ Transcription en direct (par segments)",
+            help="Chaque segment enregistré est transcrit en arrière-plan pendant que vous enregistrez le suivant"
+        )
+        
         # Enregistreur audio fonctionnel avec audiorecorder
-        st.info("🎤 Cliquez sur le bouton pour enregistrer votre rêve.")
+        if live_mode:
+            st.info("🎤 Enregistrez votre rêve en plusieurs segments, puis cliquez sur 'Terminer'.")
+        else:
+            st.info("🎤 Cliquez sur le bouton pour enregistrer votre rêve.")
+        
+        # Mode direct désactivé : libérer la transcription en cours
+        if not live_mode and 'live_transcriber' in st.session_state:
+            st.session_state.pop('live_transcriber').cancel()
         
         audio_recorder = audiorecorder("Enregistrer", "Arrêter")
         
         if len(audio_recorder) > 0:
-            # Exporter en fichier temporaire
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.wav')
-            audio_recorder.export(temp_file.name, format='wav')
-            temp_file.close()
+            # Exporter directement en mémoire (pas de fichier temporaire)
+            wav_buffer = BytesIO()
+            audio_recorder.export(wav_buffer, format='wav')
+            wav_audio_data = wav_buffer.getvalue()
             
-            # Lire le fichier en tant que bytes
-            with open(temp_file.name, 'rb') as f:
-                wav_audio_data = f.read()
-                
             st.audio(wav_audio_data, format='audio/wav')
             
-            # Convertir en objet similaire au file_uploader
-            audio_data = BytesIO(wav_audio_data)
-            audio_data.name = "recorded_audio.wav"
+            if live_mode:
+                if 'live_segment_ids' not in st.session_state:
+                    st.session_state.live_segment_ids = set()
+                
+                # Le composant renvoie le même audio à chaque rerun : n'envoyer que les nouveaux segments
+                segment_id = hash(wav_audio_data)
+                if segment_id not in st.session_state.live_segment_ids:
+                    st.session_state.live_segment_ids.add(segment_id)
+                    if 'live_transcriber' not in st.session_state:
+                        st.session_state.live_transcriber = IncrementalTranscriber(
+                            transcribe_segment=api_client.transcribe_segment if api_client else None
+                        )
+                    st.session_state.live_transcriber.submit_segment(wav_audio_data)
+            else:
+                # Convertir en objet similaire au file_uploader
+                audio_data = BytesIO(wav_audio_data)
+                audio_data.name = "recorded_audio.wav"
+        
+        if live_mode and 'live_transcriber' in st.session_state:
+            transcriber = st.session_state.live_transcriber
+            st.caption(
+                f"Segments envoyés: {transcriber.segment_count} — "
+                f"en cours de transcription: {transcriber.pending_count}"
+            )
+            partial = transcriber.partial_transcript()
+            if partial:
+                st.text_area("Transcription partielle", partial, height=100, disabled=True)
             
-            # Supprimer le fichier temporaire
-            try:
-                os.remove(temp_file.name)
-            except:
-                pass
+            if st.button("✅ Terminer et transcrire"):
+                with st.spinner("Finalisation de la transcription..."):
+                    transcript = transcriber.finish()
+                del st.session_state.live_transcriber
+                
+                if transcriber.failed_segments:
+                    failed = ", ".join(str(index + 1) for index in transcriber.failed_segments)
+                    st.warning(
+                        f"⚠️ La transcription des segments {failed} a échoué : le texte est incomplet. "
+                        "Vérifiez-le ou réenregistrez ces passages."
+                    )
+                
+                if transcript:
+                    st.session_state.dream_transcript = transcript
+                    # Laisser l'avertissement visible au lieu de relancer immédiatement
+                    if not transcriber.failed_segments:
+                        st.rerun()
+                else:
+                    st.error("Aucun segment n'a pu être transcrit.")
     else:
         # Fallback si la librairie n'est pas installée
         st.warning("⚠️ L'enregistrement direct nécessite l'installation de `streamlit-audiorecorder`. Utilisez l'onglet 'Uploader un fichier' pour le moment.")
@@ -110,12 +172,16 @@ if audio_data is not None:
                 # Transcrire l'audio
                 transcript = transcribe_audio(audio_path)
                 
-                # Afficher la transcription
-                st.markdown("### 2. Transcription de votre rêve")
-                st.text_area("Texte transcrit", transcript, height=150, key="transcription_display")
-                
-                # Sauvegarder dans la session
-                st.session_state.dream_transcript = transcript
+                # transcribe_audio signale ses échecs par un texte "Error: ..."
+                if transcript.startswith("Error:"):
+                    st.error(f"Échec de la transcription: {transcript}")
+                else:
+                    # Afficher la transcription
+                    st.markdown("### 2. Transcription de votre rêve")
+                    st.text_area("Texte transcrit", transcript, height=150, key="transcription_display")
+                    
+                    # Sauvegarder dans la session
+                    st.session_state.dream_transcript = transcript
                 
             except Exception as e:
                 st.error(f"Une erreur s'est produite: {str(e)}")
@@ -132,15 +198,32 @@ if 'dream_transcript' in st.session_state:
         key="transcript_editor"
     )
     
+    # Option : lancer la génération de l'image dès que l'analyse est terminée
+    speculative_mode = st.checkbox(
+        "⚡ Pré-générer l'image en style automatique pendant que vous choisissez",
+        help="L'image est générée en arrière-plan et affichée immédiatement si vous gardez le style 'automatic' en 1024x1024"
+    )
+    
     # Bouton pour analyser le texte
     if st.button("Analyser le rêve avec Mistral"):
+        # Une nouvelle analyse rend caduques la pré-génération en cours et l'image précédente
+        if 'speculative_job' in st.session_state:
+            discard_speculative_generation(st.session_state.pop('speculative_job'))
+        st.session_state.pop('speculative_started', None)
+        st.session_state.pop('speculative_skipped', None)
+        st.session_state.pop('generated_image', None)
+        
         with st.spinner("Analyse du rêve en cours..."):
             try:
-                # Extraire les éléments visuels
-                visual_analysis = extract_visual_elements(modified_transcript)
-                
-                # Analyser le sentiment
-                sentiment_analysis = analyze_dream_sentiment(modified_transcript)
+                if api_client:
+                    # Les deux analyses sont faites en un seul appel au service
+                    visual_analysis, sentiment_analysis = api_client.analyze_dream(modified_transcript)
+                else:
+                    # Extraire les éléments visuels
+                    visual_analysis = extract_visual_elements(modified_transcript)
+                    
+                    # Analyser le sentiment
+                    sentiment_analysis = analyze_dream_sentiment(modified_transcript)
                 
                 # Sauvegarder les analyses
                 st.session_state.visual_analysis = visual_analysis
@@ -167,6 +250,15 @@ if 'dream_transcript' in st.session_state:
                 st.markdown("#### 📝 Description optimisée pour l'image")
                 st.write(visual_analysis.get("prompt_optimise", ""))
                 
+                # Statistiques des appels Mistral de cette session (le service les expose sur /metrics)
+                if not api_client:
+                    with st.expander("Statistiques des appels Mistral"):
+                        st.json({
+                            "tokens": get_token_stats(),
+                            "parsing": get_parse_metrics(),
+                            "routage": get_routing_stats()
+                        })
+                
             except Exception as e:
                 st.error(f"Erreur lors de l'analyse: {str(e)}")
     
@@ -224,23 +316,72 @@ if 'dream_transcript' in st.session_state:
         final_prompt = image_prompt_data["prompt_principal"]
         st.code(final_prompt)
         
+        # Abandonner la pré-génération dès que l'utilisateur choisit d'autres paramètres
+        speculative_job = st.session_state.get('speculative_job')
+        if speculative_job is not None:
+            speculative_request = (final_prompt, selected_style, image_width, image_height)
+            if speculative_request != (speculative_job["prompt"], speculative_job["style"], speculative_job["width"], speculative_job["height"]):
+                discard_speculative_generation(st.session_state.pop('speculative_job'))
+        
+        # Pré-générer dès que l'analyse est disponible, même si l'option est cochée après coup,
+        # mais seulement si les paramètres affichés sont ceux de la pré-génération
+        # (une seule pré-génération par analyse)
+        if (speculative_mode
+                and selected_style == SPECULATIVE_STYLE
+                and image_width == SPECULATIVE_IMAGE_SIZE
+                and image_height == SPECULATIVE_IMAGE_SIZE
+                and 'speculative_job' not in st.session_state
+                and not st.session_state.get('speculative_started')):
+            speculative_job = start_speculative_generation(
+                final_prompt,
+                SPECULATIVE_STYLE,
+                SPECULATIVE_IMAGE_SIZE,
+                SPECULATIVE_IMAGE_SIZE,
+                generator=generate_image_with_clipboard,
+                # Un seul refus compté par analyse, quel que soit le nombre de reruns
+                count_skip=not st.session_state.get('speculative_skipped')
+            )
+            # None si le plafond global de générations spéculatives est atteint (nouvel essai au prochain rerun)
+            if speculative_job is None:
+                st.session_state.speculative_skipped = True
+            else:
+                st.session_state.speculative_job = speculative_job
+                st.session_state.speculative_started = True
+        
         # Bouton de génération d'image
         if st.button("🎨 Générer l'image", type="primary"):
             with st.spinner("Génération de l'image en cours... Cela peut prendre quelques instants..."):
                 try:
-                    # Générer l'image avec l'API Clipboard
-                    result = generate_image_with_clipboard(
-                        prompt=final_prompt,
-                        style=selected_style
-                    )
+                    # Réutiliser la pré-génération si elle correspond à la demande
+                    result = None
+                    if 'speculative_job' in st.session_state:
+                        result = claim_speculative_generation(
+                            st.session_state.pop('speculative_job'),
+                            final_prompt,
+                            selected_style,
+                            image_width,
+                            image_height
+                        )
+                    
+                    if result is None:
+                        # Générer l'image avec l'API Clipboard
+                        result = generate_image_with_clipboard(
+                            prompt=final_prompt,
+                            style=selected_style,
+                            width=image_width,
+                            height=image_height
+                        )
                     
                     if result["success"]:
                         # Afficher l'image générée
                         st.success("🎉 Image générée avec succès !")
                         
-                        # Afficher l'image
+                        # Variantes produites en arrière-plan : l'affichage n'attend que le redimensionnement
+                        variants = result["variants"]
+                        
+                        # Afficher l'image à la taille demandée
                         st.image(
-                            result["image"], 
+                            variants["requested"].result(), 
                             caption=f"Votre rêve visualisé en style {selected_style}",
                             use_column_width=True
                         )
@@ -250,26 +391,37 @@ if 'dream_transcript' in st.session_state:
                             st.json({
                                 "style_utilisé": result["style"],
                                 "prompt_utilisé": result["prompt_used"],
-                                "dimensions": f"{image_width}x{image_height}",
-                                "chemin_image": result["image_path"]
+                                "dimensions": variants["dimensions"],
+                                "chemin_image": result["image_path"],
+                                "pré_génération": get_speculative_stats()
                             })
                         
                         # Sauvegarder dans la session
                         st.session_state.generated_image = result
                         
-                        # Bouton de téléchargement
-                        if st.button("💾 Télécharger l'image"):
-                            # Convertir l'image en bytes pour le téléchargement
-                            img_bytes = BytesIO()
-                            result["image"].save(img_bytes, format='PNG')
-                            img_bytes.seek(0)
-                            
+                        # Boutons de téléchargement (chaque format attend son propre encodage)
+                        dl_col1, dl_col2, dl_col3 = st.columns(3)
+                        with dl_col1:
                             st.download_button(
                                 label="📁 Télécharger PNG",
-                                data=img_bytes.getvalue(),
+                                data=variants["png"].result(),
                                 file_name=f"dream_image_{selected_style}.png",
                                 mime="image/png"
                             )
+                        with dl_col2:
+                            st.download_button(
+                                label="📁 Télécharger WebP",
+                                data=variants["webp"].result(),
+                                file_name=f"dream_image_{selected_style}.webp",
+                                mime="image/webp"
+                            )
+                        with dl_col3:
+                            st.download_button(
+                                label="📁 Télécharger JPEG",
+                                data=variants["jpeg"].result(),
+                                file_name=f"dream_image_{selected_style}.jpg",
+                                mime="image/jpeg"
+                            )
                     
                     else:
                         # Afficher l'erreur
@@ -286,6 +438,13 @@ if 'dream_transcript' in st.session_state:
         if 'generated_image' in st.session_state:
             st.markdown("### 5. Actions supplémentaires")
             
+            # Aperçu léger de la dernière image (miniature WebP déjà encodée)
+            st.image(
+                st.session_state.generated_image["variants"]["thumbnail_webp"].result(),
+                caption="Dernière image générée",
+                width=256
+            )
+            
             col1, col2, col3 = st.columns(3)
             
             with col1:
@@ -301,6 +460,11 @@ if 'dream_transcript' in st.session_state:
             
             with col3:
                 if st.button("🆕 Nouveau rêve"):
+                    if 'speculative_job' in st.session_state:
+                        discard_speculative_generation(st.session_state.speculative_job)
+                    if 'live_transcriber' in st.session_state:
+                        st.session_state.live_transcriber.cancel()
+                    
                     # Effacer toute la session
                     for key in list(st.session_state.keys()):
                         del st.session_state[key]
@@ -1,7 +1,9 @@
 import os
 import tempfile
 import json
+import threading
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 import soundfile as sf
 import numpy as np
 from groq import Groq
@@ -38,6 +40,12 @@ def preprocess_audio(audio_file):
     # Sauvegarder l'audio normalisé
     normalized_path = f"{temp_audio_path}_normalized.wav"
     sf.write(normalized_path, data, samplerate)
+    
+    # Le fichier brut n'est plus utile (transcribe_audio supprime le fichier normalisé)
+    try:
+        os.remove(temp_audio_path)
+    except OSError:
+        pass
     return normalized_path
 
 def transcribe_audio(audio_path):
@@ -68,3 +76,111 @@ def transcribe_audio(audio_path):
     except Exception as e:
         print(f"Error transcribing audio: {e}")
         return f"Error: {str(e)}"
+
+
+class IncrementalTranscriber:
+    """
+    Transcrit les segments d'un enregistrement en arrière-plan, au fur et à mesure
+    qu'ils sont terminés, pour que seule la fin reste à traiter à l'arrêt
+    """
+
+    def __init__(self, max_workers=2, transcribe_segment=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = []
+        self._segments = []
+        self._lock = threading.Lock()
+        # Index (à partir de 0) des segments dont la transcription a échoué
+        self.failed_segments = []
+        # Permet de déléguer la transcription (ex: client de l'API HTTP)
+        self._transcribe = transcribe_segment or self._transcribe_segment
+
+    @staticmethod
+    def _transcribe_segment(wav_bytes):
+        audio_data = BytesIO(wav_bytes)
+        audio_path = preprocess_audio(audio_data)
+        return transcribe_audio(audio_path)
+
+    def submit_segment(self, wav_bytes):
+        """
+        Envoie un segment WAV terminé à la transcription en arrière-plan
+
+        Returns:
+            int: L'index du segment
+        """
+        with self._lock:
+            self._segments.append(wav_bytes)
+            self._futures.append(self._executor.submit(self._transcribe, wav_bytes))
+            return len(self._futures) - 1
+
+    @property
+    def segment_count(self):
+        return len(self._futures)
+
+    @property
+    def pending_count(self):
+        return sum(1 for future in self._futures if not future.done())
+
+    def partial_transcript(self):
+        """
+        Retourne le texte des premiers segments déjà transcrits (dans l'ordre)
+        """
+        parts = []
+        for future in self._futures:
+            if not future.done():
+                break
+            parts.append(self._segment_text(future))
+        return " ".join(part for part in parts if part)
+
+    def finish(self, timeout=None):
+        """
+        Attend les segments restants et retourne la transcription complète.
+        Un segment en échec est retranscrit une fois ; s'il échoue encore,
+        son index est ajouté à failed_segments.
+        """
+        parts = []
+        self.failed_segments = []
+        try:
+            for index, future in enumerate(self._futures):
+                text = self._segment_text(future, timeout)
+                if text is None:
+                    # Nouvel essai synchrone pour ne pas laisser de trou dans le récit
+                    try:
+                        text = self._clean_text(self._transcribe(self._segments[index]))
+                    except Exception as e:
+                        print(f"Error transcribing segment: {e}")
+                if text is None:
+                    self.failed_segments.append(index)
+                else:
+                    parts.append(text)
+        finally:
+            self._executor.shutdown(wait=False)
+        return " ".join(part for part in parts if part)
+
+    def cancel(self):
+        """
+        Abandonne l'enregistrement : les segments pas encore commencés sont annulés
+        et les threads sont libérés
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _clean_text(text):
+        """
+        Retourne le texte transcrit, ou None si la transcription a échoué
+        """
+        # transcribe_audio renvoie "Error: ..." en cas d'échec
+        if not isinstance(text, str) or text.startswith("Error:"):
+            return None
+        return text.strip()
+
+    @staticmethod
+    def _segment_text(future, timeout=None):
+        """
+        Retourne le texte d'un segment, ou None si sa transcription a échoué
+        """
+        try:
+            text = future.result(timeout=timeout)
+        except Exception as e:
+            print(f"Error transcribing segment: {e}")
+            return None
+        return IncrementalTranscriber._clean_text(text)
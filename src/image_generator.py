@@ -1,7 +1,10 @@
 import os
 import requests
+import hashlib
+import threading
 from io import BytesIO
-from PIL import Image
+from concurrent.futures import Future, ThreadPoolExecutor
+from PIL import Image, ImageOps
 from dotenv import load_dotenv
 import tempfile
 import time
@@ -13,13 +16,49 @@ load_dotenv()
 CLIPBOARD_API_KEY = os.getenv("CLIPBOARD_API_KEY")
 CLIPBOARD_BASE_URL = "https://clipdrop-api.co"
 
-def generate_image_with_clipboard(prompt, style="automatic"):
+# Post-traitement des images (redimensionnement et formats web)
+THUMBNAIL_SIZE = (256, 256)
+WEBP_QUALITY = 85
+JPEG_QUALITY = 88
+MAX_CACHED_VARIANTS = 32
+
+# Formats produits pour chaque image : nom -> (format Pillow, options d'encodage)
+VARIANT_ENCODINGS = {
+    "png": ("PNG", {"optimize": True}),
+    "webp": ("WEBP", {"quality": WEBP_QUALITY, "method": 4}),
+    "jpeg": ("JPEG", {"quality": JPEG_QUALITY, "optimize": True, "progressive": True}),
+    "thumbnail_webp": ("WEBP", {"quality": WEBP_QUALITY})
+}
+# Variantes encodées à partir de la miniature plutôt que de la taille demandée
+THUMBNAIL_VARIANTS = {"thumbnail_webp"}
+
+# Pillow libère le GIL pendant le redimensionnement et l'encodage : un pool de threads suffit
+_variant_executor = ThreadPoolExecutor(max_workers=3)
+_variant_cache = {}
+_variant_cache_lock = threading.Lock()
+
+# Génération spéculative : plafond global du nombre de générations anticipées en cours
+# (0 désactive la génération spéculative)
+try:
+    MAX_SPECULATIVE_JOBS = max(0, int(os.getenv("MAX_SPECULATIVE_JOBS", "2")))
+except ValueError:
+    MAX_SPECULATIVE_JOBS = 2
+_speculative_executor = ThreadPoolExecutor(max_workers=max(1, MAX_SPECULATIVE_JOBS))
+_speculative_slots = threading.BoundedSemaphore(MAX_SPECULATIVE_JOBS)
+_speculative_stats = {"started": 0, "hits": 0, "wasted": 0, "failed": 0, "skipped_cap": 0}
+_speculative_stats_lock = threading.Lock()
+
+def generate_image_with_clipboard(prompt, style="automatic", width=None, height=None, bytes_only=False):
     """
     Génère une image avec l'API Clipboard
     
     Args:
         prompt (str): Le prompt pour générer l'image
         style (str): Le style de l'image
+        width (int): Largeur demandée pour la variante redimensionnée
+        height (int): Hauteur demandée pour la variante redimensionnée
+        bytes_only (bool): Ne renvoyer que les octets de l'image (ni décodage,
+            ni variantes, ni fichier temporaire), pour le service HTTP
         
     Returns:
         dict: Résultat avec l'image générée ou une erreur
@@ -52,8 +91,20 @@ def generate_image_with_clipboard(prompt, style="automatic"):
         response = requests.post(url, headers=headers, files=files)
         
         if response.status_code == 200:
+            if bytes_only:
+                return {
+                    "success": True,
+                    "image_bytes": response.content,
+                    "prompt_used": styled_prompt,
+                    "style": style
+                }
+            
             # Convertir la réponse en image
             image = Image.open(BytesIO(response.content))
+            image.load()
+            
+            # Lancer la production des variantes en arrière-plan
+            variants = submit_image_variants(image, width, height)
             
             # Sauvegarder temporairement l'image
             temp_path = save_temp_image(image)
@@ -62,6 +113,7 @@ def generate_image_with_clipboard(prompt, style="automatic"):
                 "success": True,
                 "image_path": temp_path,
                 "image": image,
+                "variants": variants,
                 "prompt_used": styled_prompt,
                 "style": style
             }
@@ -118,6 +170,210 @@ def save_temp_image(image, filename_prefix="dream_image"):
     
     return temp_path
 
+def image_content_hash(image):
+    """
+    Calcule l'empreinte SHA-256 du contenu d'une image (pixels, taille et mode)
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+def _encode_image(image, format, **options):
+    buffer = BytesIO()
+    image.save(buffer, format=format, **options)
+    return buffer.getvalue()
+
+def _resize_image(image, width, height):
+    """
+    Recadrage centré au ratio demandé puis rééchantillonnage Lanczos
+    """
+    rgb_image = image.convert("RGB")
+    if (width, height) == rgb_image.size:
+        return rgb_image
+    return ImageOps.fit(rgb_image, (width, height), method=Image.LANCZOS)
+
+def _make_thumbnail(image):
+    thumbnail = image.copy()
+    thumbnail.thumbnail(THUMBNAIL_SIZE, Image.LANCZOS)
+    return thumbnail
+
+def _encode_variant(image, name):
+    format, options = VARIANT_ENCODINGS[name]
+    if name in THUMBNAIL_VARIANTS:
+        image = _make_thumbnail(image)
+    return _encode_image(image, format, **options)
+
+def _cache_variants(cache_key, variants):
+    with _variant_cache_lock:
+        # Éviction des entrées les plus anciennes
+        while len(_variant_cache) >= MAX_CACHED_VARIANTS:
+            _variant_cache.pop(next(iter(_variant_cache)))
+        _variant_cache[cache_key] = variants
+
+def create_image_variants(image, width=None, height=None):
+    """
+    Produit la taille demandée, ses versions PNG/WebP/JPEG et une miniature WebP
+    (de manière synchrone)
+    
+    Args:
+        image (PIL.Image): L'image pleine taille générée
+        width (int): Largeur demandée (taille d'origine si None)
+        height (int): Hauteur demandée (taille d'origine si None)
+        
+    Returns:
+        dict: Les variantes, mises en cache par empreinte de contenu
+    """
+    width = width or image.width
+    height = height or image.height
+    cache_key = (image_content_hash(image), width, height, "sync")
+    
+    with _variant_cache_lock:
+        if cache_key in _variant_cache:
+            return _variant_cache[cache_key]
+    
+    requested = _resize_image(image, width, height)
+    variants = {
+        "content_hash": cache_key[0],
+        "dimensions": f"{width}x{height}",
+        "requested": requested
+    }
+    for name in VARIANT_ENCODINGS:
+        variants[name] = _encode_variant(requested, name)
+    
+    _cache_variants(cache_key, variants)
+    return variants
+
+def _encode_into(future, image, name):
+    try:
+        future.set_result(_encode_variant(image, name))
+    except Exception as e:
+        future.set_exception(e)
+
+def submit_image_variants(image, width=None, height=None):
+    """
+    Lance le redimensionnement puis chaque encodage sur le pool de threads.
+    L'image redimensionnée est disponible dès que possible ; chaque format est
+    encodé séparément pour qu'un affichage n'attende pas les autres encodages.
+
+    Returns:
+        dict: "content_hash", "dimensions", puis un Future pour "requested"
+        (PIL.Image) et pour chaque format encodé ("png", "webp", "jpeg", "thumbnail_webp")
+    """
+    width = width or image.width
+    height = height or image.height
+    cache_key = (image_content_hash(image), width, height, "async")
+    
+    with _variant_cache_lock:
+        if cache_key in _variant_cache:
+            return _variant_cache[cache_key]
+    
+    requested = _variant_executor.submit(_resize_image, image, width, height)
+    variants = {
+        "content_hash": cache_key[0],
+        "dimensions": f"{width}x{height}",
+        "requested": requested
+    }
+    encoded = {name: Future() for name in VARIANT_ENCODINGS}
+    variants.update(encoded)
+    
+    def _on_resized(resized):
+        # Les encodages ne démarrent qu'une fois l'image redimensionnée
+        error = resized.exception()
+        for name, future in encoded.items():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                _variant_executor.submit(_encode_into, future, resized.result(), name)
+    
+    requested.add_done_callback(_on_resized)
+    _cache_variants(cache_key, variants)
+    return variants
+
+def _count_speculative(outcome):
+    with _speculative_stats_lock:
+        _speculative_stats[outcome] += 1
+
+def start_speculative_generation(prompt, style="automatic", width=None, height=None, generator=None, count_skip=True):
+    """
+    Lance en arrière-plan la génération d'une image que l'utilisateur demandera probablement
+    
+    Args:
+        prompt (str): Le prompt anticipé
+        style (str): Le style anticipé
+        width (int): Largeur anticipée
+        height (int): Hauteur anticipée
+        generator (callable): Fonction de génération (generate_image_with_clipboard par défaut)
+        count_skip (bool): Compter un refus dû au plafond (False pour les nouvelles
+            tentatives d'une même demande, déjà comptée)
+        
+    Returns:
+        dict: La tâche spéculative, ou None si le plafond global est atteint
+    """
+    if not _speculative_slots.acquire(blocking=False):
+        if count_skip:
+            _count_speculative("skipped_cap")
+            print(f"Pré-génération ignorée : {MAX_SPECULATIVE_JOBS} générations spéculatives déjà en cours")
+        return None
+    
+    generator = generator or generate_image_with_clipboard
+    try:
+        future = _speculative_executor.submit(generator, prompt, style, width, height)
+    except Exception:
+        _speculative_slots.release()
+        raise
+    future.add_done_callback(lambda _: _speculative_slots.release())
+    _count_speculative("started")
+    
+    return {
+        "future": future,
+        "prompt": prompt,
+        "style": style,
+        "width": width,
+        "height": height
+    }
+
+def discard_speculative_generation(job):
+    """
+    Abandonne une génération spéculative (annulée si elle n'a pas encore démarré)
+    """
+    job["future"].cancel()
+    _count_speculative("wasted")
+
+def claim_speculative_generation(job, prompt, style="automatic", width=None, height=None):
+    """
+    Récupère le résultat spéculatif s'il correspond exactement à la demande
+    
+    Returns:
+        dict: Le résultat de la génération, ou None s'il faut générer normalement
+    """
+    if (job["prompt"], job["style"], job["width"], job["height"]) != (prompt, style, width, height):
+        discard_speculative_generation(job)
+        return None
+    
+    try:
+        result = job["future"].result()
+    except Exception:
+        result = None
+    
+    if not result or not result.get("success"):
+        _count_speculative("failed")
+        return None
+    
+    _count_speculative("hits")
+    return result
+
+def get_speculative_stats():
+    """
+    Retourne les compteurs de génération spéculative et les taux de succès/gaspillage
+    """
+    with _speculative_stats_lock:
+        stats = dict(_speculative_stats)
+    started = stats["started"]
+    stats["hit_rate"] = stats["hits"] / started if started else 0.0
+    stats["waste_rate"] = (stats["wasted"] + stats["failed"]) / started if started else 0.0
+    return stats
+
 def get_available_styles():
     """
     Retourne la liste des styles disponibles avec leurs descriptions
@@ -0,0 +1,147 @@
+import os
+import re
+import random
+import logging
+import threading
+from token_budget import estimate_tokens
+
+# Politique de routage (modifiable via configure_routing ou les variables d'environnement)
+ROUTING_CONFIG = {
+    "small_model": os.getenv("MISTRAL_SMALL_MODEL", "mistral-small-latest"),
+    "large_model": os.getenv("MISTRAL_LARGE_MODEL", "mistral-large-latest"),
+    # Au-delà de ce nombre de tokens, la transcription part sur le grand modèle
+    "max_small_tokens": int(os.getenv("MISTRAL_ROUTING_MAX_SMALL_TOKENS", "250")),
+    # Au-delà de ce score de complexité (0 à 1), la transcription part sur le grand modèle
+    "max_small_complexity": float(os.getenv("MISTRAL_ROUTING_MAX_SMALL_COMPLEXITY", "0.6")),
+    # Poids de la dernière mesure dans la moyenne mobile des latences
+    "latency_smoothing": 0.3,
+    # Part du trafic éligible envoyée au petit modèle même s'il paraît plus lent,
+    # pour que sa latence mesurée continue d'être mise à jour
+    "exploration_rate": float(os.getenv("MISTRAL_ROUTING_EXPLORATION_RATE", "0.1")),
+    "enabled": os.getenv("MISTRAL_ROUTING_ENABLED", "true").lower() != "false"
+}
+
+# Marqueurs de changement de scène fréquents dans les récits de rêves
+SCENE_CHANGE_PATTERN = re.compile(
+    r"\b(?:puis|ensuite|soudain|soudainement|tout à coup|d'un coup|après|alors|et là)\b",
+    flags=re.IGNORECASE
+)
+
+# Latence moyenne observée par modèle (secondes par token généré)
+_model_latency = {}
+_model_latency_lock = threading.Lock()
+# Statistiques par route (appel, modèle) -> compteurs
+_route_stats = {}
+_route_stats_lock = threading.Lock()
+
+def configure_routing(**overrides):
+    """
+    Met à jour la politique de routage (ex: configure_routing(max_small_tokens=400))
+    """
+    unknown = set(overrides) - set(ROUTING_CONFIG)
+    if unknown:
+        raise ValueError(f"Paramètres de routage inconnus: {', '.join(sorted(unknown))}")
+    ROUTING_CONFIG.update(overrides)
+
+def complexity_score(text):
+    """
+    Estime la complexité d'un récit entre 0 et 1 (scènes, longueur des phrases, vocabulaire)
+    """
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return 0.0
+
+    sentences = [s for s in re.split(r"[.!?]+", text) if s.strip()]
+    scene_changes = len(SCENE_CHANGE_PATTERN.findall(text))
+    avg_sentence_length = len(words) / max(1, len(sentences))
+    long_words = sum(1 for word in words if len(word) >= 9) / len(words)
+
+    score = (
+        min(1.0, scene_changes / 6) * 0.4
+        + min(1.0, avg_sentence_length / 30) * 0.3
+        + min(1.0, long_words / 0.25) * 0.3
+    )
+    return round(score, 3)
+
+def choose_model(text):
+    """
+    Choisit le modèle Mistral pour une transcription
+
+    Returns:
+        tuple: (nom du modèle, raison du choix)
+    """
+    small = ROUTING_CONFIG["small_model"]
+    large = ROUTING_CONFIG["large_model"]
+
+    if not ROUTING_CONFIG["enabled"]:
+        return large, "routing_disabled"
+
+    if estimate_tokens(text) > ROUTING_CONFIG["max_small_tokens"]:
+        return large, "long_transcript"
+
+    if complexity_score(text) > ROUTING_CONFIG["max_small_complexity"]:
+        return large, "complex_transcript"
+
+    # Le petit modèle n'a d'intérêt que s'il reste plus rapide en pratique
+    # (latences comparées par token généré, indépendamment de la taille des prompts)
+    with _model_latency_lock:
+        small_latency = _model_latency.get(small)
+        large_latency = _model_latency.get(large)
+    if small_latency is not None and large_latency is not None and small_latency >= large_latency:
+        # Une part du trafic continue d'explorer le petit modèle pour pouvoir revenir dessus
+        if random.random() < ROUTING_CONFIG["exploration_rate"]:
+            return small, "exploration"
+        return large, "small_model_slower"
+
+    return small, "short_transcript"
+
+def record_latency(model, seconds, output_tokens):
+    """
+    Met à jour la latence moyenne observée d'un modèle, ramenée au token généré
+    """
+    per_token = seconds / max(1, output_tokens)
+    alpha = ROUTING_CONFIG["latency_smoothing"]
+    with _model_latency_lock:
+        previous = _model_latency.get(model)
+        if previous is None:
+            _model_latency[model] = per_token
+        else:
+            _model_latency[model] = alpha * per_token + (1 - alpha) * previous
+
+def record_route(call_name, model, reason, latency, escalated=False):
+    """
+    Enregistre une décision de routage et la latence totale de la requête
+    (la route est celle du modèle choisi initialement, escalade comprise)
+    """
+    with _route_stats_lock:
+        stats = _route_stats.setdefault(f"{call_name}:{model}", {
+            "calls": 0,
+            "escalations": 0,
+            "total_latency": 0.0,
+            "reasons": {}
+        })
+        stats["calls"] += 1
+        stats["total_latency"] += latency
+        stats["reasons"][reason] = stats["reasons"].get(reason, 0) + 1
+        if escalated:
+            stats["escalations"] += 1
+
+    logging.info(
+        f"{call_name}: modèle {model} ({reason}), {latency:.2f}s"
+        + (" après escalade" if escalated else "")
+    )
+
+def get_routing_stats():
+    """
+    Retourne les décisions de routage, les latences par route (secondes)
+    et par modèle (secondes par token généré)
+    """
+    routes = {}
+    with _route_stats_lock:
+        for route, stats in _route_stats.items():
+            routes[route] = dict(stats)
+            routes[route]["reasons"] = dict(stats["reasons"])
+            routes[route]["avg_latency"] = stats["total_latency"] / stats["calls"]
+    with _model_latency_lock:
+        model_latency = dict(_model_latency)
+    return {"routes": routes, "model_latency": model_latency}
@@ -0,0 +1,176 @@
+import re
+import json
+import logging
+import threading
+
+# Compteurs de parsing par appel (nom de la fonction -> issue -> nombre)
+_parse_metrics = {}
+_parse_metrics_lock = threading.Lock()
+
+PARSE_OUTCOMES = ("direct", "repaired", "reasked", "partial_fallback", "fallback", "error")
+
+def _strip_code_fences(text):
+    """
+    Retire les blocs ```json ... ``` qui entourent parfois la réponse
+    """
+    match = re.search(r"```(?:json|JSON)?\s*(.*?)```", text, flags=re.DOTALL)
+    if match:
+        return match.group(1)
+    return text
+
+def _find_balanced_object(text):
+    """
+    Retourne le premier objet JSON {...} équilibré trouvé dans le texte
+    (les accolades à l'intérieur des chaînes sont ignorées)
+    """
+    start = text.find("{")
+    while start != -1:
+        depth = 0
+        in_string = False
+        escaped = False
+        for index in range(start, len(text)):
+            char = text[index]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == "{":
+                depth += 1
+            elif char == "}":
+                depth -= 1
+                if depth == 0:
+                    return text[start:index + 1]
+        # Objet non refermé : essayer à partir de l'accolade suivante
+        start = text.find("{", start + 1)
+    return None
+
+def _repair_json(text):
+    """
+    Supprime les virgules finales avant } ou ] (hors chaînes de caractères)
+    """
+    repaired = []
+    pending_comma = None
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            repaired.append(char)
+            continue
+
+        if pending_comma is not None:
+            if char.isspace():
+                pending_comma.append(char)
+                continue
+            # Virgule suivie de } ou ] : on ne garde que les espaces
+            if char in "}]":
+                repaired.extend(pending_comma[1:])
+            else:
+                repaired.extend(pending_comma)
+            pending_comma = None
+
+        if char == ",":
+            pending_comma = [char]
+        else:
+            if char == '"':
+                in_string = True
+            repaired.append(char)
+
+    if pending_comma is not None:
+        repaired.extend(pending_comma)
+    return "".join(repaired)
+
+def parse_json_response(content):
+    """
+    Parse une réponse de LLM en JSON de manière tolérante
+
+    Args:
+        content (str): Le texte brut renvoyé par le modèle
+
+    Returns:
+        tuple: (dict ou None, "direct" | "repaired" | None)
+    """
+    if not content:
+        return None, None
+
+    try:
+        data = json.loads(content)
+        if isinstance(data, dict):
+            return data, "direct"
+    except (json.JSONDecodeError, TypeError):
+        pass
+
+    candidate = _find_balanced_object(_strip_code_fences(content))
+    if candidate is None:
+        # Le premier bloc ``` peut ne pas être le JSON (exemple, bloc vide) : chercher partout
+        candidate = _find_balanced_object(content)
+    if candidate is None:
+        return None, None
+
+    for attempt in (candidate, _repair_json(candidate)):
+        try:
+            data = json.loads(attempt)
+            if isinstance(data, dict):
+                return data, "repaired"
+        except json.JSONDecodeError:
+            continue
+
+    return None, None
+
+def find_missing_fields(data, required_fields):
+    """
+    Liste les champs obligatoires absents, vides ou du mauvais type
+
+    Args:
+        data (dict): La réponse parsée
+        required_fields (dict): Nom du champ -> type attendu (dict, list, str)
+
+    Returns:
+        list: Les noms des champs à redemander
+    """
+    missing = []
+    for field, expected_type in required_fields.items():
+        value = data.get(field)
+        if not isinstance(value, expected_type) or not value:
+            missing.append(field)
+    return missing
+
+def record_parse_outcome(call_name, outcome):
+    """
+    Enregistre l'issue du parsing d'une réponse (direct, repaired, reasked, partial_fallback, fallback, error)
+    """
+    with _parse_metrics_lock:
+        metrics = _parse_metrics.setdefault(call_name, {name: 0 for name in PARSE_OUTCOMES})
+        metrics[outcome] = metrics.get(outcome, 0) + 1
+    if outcome == "fallback":
+        logging.warning(f"{call_name}: réponse JSON inexploitable, utilisation de la structure de secours")
+    elif outcome == "partial_fallback":
+        logging.warning(f"{call_name}: champs introuvables complétés par la structure de secours")
+
+def get_parse_metrics():
+    """
+    Retourne les compteurs de parsing et le taux de fallback par appel
+    """
+    with _parse_metrics_lock:
+        snapshot = {call_name: dict(metrics) for call_name, metrics in _parse_metrics.items()}
+    report = {}
+    for call_name, metrics in snapshot.items():
+        total = sum(metrics.values())
+        report[call_name] = dict(metrics)
+        report[call_name]["total"] = total
+        # Erreurs d'API et JSON inexploitable aboutissent tous deux à la structure de secours,
+        # les réponses complétées partiellement comptent aussi comme des fallbacks
+        fallbacks = metrics["fallback"] + metrics["error"] + metrics["partial_fallback"]
+        report[call_name]["fallback_rate"] = fallbacks / total if total else 0.0
+        report[call_name]["partial_fallback_rate"] = metrics["partial_fallback"] / total if total else 0.0
+    return report
@@ -1,7 +1,10 @@
 import os
-import json
+import time
 from mistralai.client import MistralClient
 from dotenv import load_dotenv
+from token_budget import compact_transcript, estimate_tokens, max_tokens_for_schema, record_token_usage
+from response_parser import parse_json_response, find_missing_fields, record_parse_outcome
+from model_router import ROUTING_CONFIG, choose_model, record_latency, record_route
 
 # Charger les variables d'environnement
 load_dotenv()
@@ -10,17 +13,168 @@ load_dotenv()
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
 client = MistralClient(api_key=MISTRAL_API_KEY)
 
+# Schémas JSON attendus (inclus dans les prompts et utilisés pour dimensionner max_tokens)
+VISUAL_SCHEMA = """{
+    "elements_visuels": {
+        "personnages": ["description des personnages"],
+        "objets": ["liste des objets importants"],
+        "environnement": "description de l'environnement/lieu",
+        "couleurs": ["couleurs dominantes"],
+        "lumiere": "description de l'éclairage"
+    },
+    "ambiance": {
+        "emotion": "émotion principale (joyeux, anxieux, paisible, etc.)",
+        "atmosphere": "description de l'atmosphère",
+        "intensite": "faible/moyenne/forte"
+    },
+    "style_recommande": "style artistique recommandé",
+    "prompt_optimise": "description complète et optimisée pour générateur d'images",
+    "mots_cles": ["mots-clés importants pour l'image"]
+}"""
+
+VISUAL_REQUIRED_FIELDS = {
+    "elements_visuels": dict,
+    "ambiance": dict,
+    "style_recommande": str,
+    "prompt_optimise": str,
+    "mots_cles": list
+}
+
+SENTIMENT_SCHEMA = """{
+    "sentiment_global": "positif/neutre/négatif",
+    "emotions_principales": ["liste des émotions détectées"],
+    "niveau_stress": "faible/moyen/élevé",
+    "type_reve": "cauchemar/rêve paisible/rêve aventureux/rêve étrange/autre",
+    "recommandation_style": "style visuel recommandé basé sur l'émotion"
+}"""
+
+SENTIMENT_REQUIRED_FIELDS = {
+    "sentiment_global": str,
+    "emotions_principales": list,
+    "niveau_stress": str,
+    "type_reve": str,
+    "recommandation_style": str
+}
+
+def _chat_json(model, messages, temperature, max_tokens):
+    """
+    Appel Mistral en mode JSON, avec mesure de la latence du modèle.
+    Une réponse tronquée (finish_reason "length") est redemandée une fois
+    avec un budget doublé.
+    """
+    for attempt in range(2):
+        start = time.perf_counter()
+        response = client.chat.complete(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            response_format={"type": "json_object"}
+        )
+        elapsed = time.perf_counter() - start
+
+        choice = response.choices[0]
+        usage = getattr(response, "usage", None)
+        output_tokens = getattr(usage, "completion_tokens", None) or estimate_tokens(choice.message.content)
+        record_latency(model, elapsed, output_tokens)
+
+        finish_reason = getattr(choice.finish_reason, "value", choice.finish_reason)
+        if finish_reason != "length" or attempt == 1:
+            return choice.message.content
+
+        print(f"Réponse Mistral tronquée ({model}), nouvel essai avec max_tokens={max_tokens * 2}")
+        max_tokens *= 2
+
+def _request_json(call_name, prompt, required_fields, defaults, temperature, max_tokens, text=None):
+    """
+    Appelle Mistral en mode JSON, parse la réponse de manière tolérante et
+    redemande uniquement les champs manquants si nécessaire
+
+    Args:
+        call_name (str): Nom de l'appel (pour les métriques)
+        prompt (str): Le prompt complet
+        required_fields (dict): Champs obligatoires et leur type
+        defaults (dict): Structure de secours utilisée pour les champs introuvables
+        temperature (float): Température du modèle
+        max_tokens (int): Taille maximale de la réponse
+        text (str): Transcription utilisée pour choisir le modèle (grand modèle si None)
+
+    Returns:
+        dict: La réponse validée, complétée par les valeurs de secours si besoin
+    """
+    large_model = ROUTING_CONFIG["large_model"]
+    if text is None:
+        model, reason = large_model, "default"
+    else:
+        model, reason = choose_model(text)
+    routed_model = model
+
+    start = time.perf_counter()
+    messages = [{"role": "user", "content": prompt}]
+    try:
+        content = _chat_json(model, messages, temperature, max_tokens)
+    except Exception as e:
+        # Une erreur du petit modèle déclenche aussi l'escalade
+        if model == large_model:
+            raise
+        print(f"Erreur Mistral ({model}), escalade vers {large_model}: {e}")
+        content = None
+    data, outcome = parse_json_response(content)
+
+    # Escalade vers le grand modèle si le petit ne respecte pas le schéma
+    escalated = False
+    if model != large_model and (data is None or find_missing_fields(data, required_fields)):
+        escalated = True
+        model = large_model
+        content = _chat_json(model, messages, temperature, max_tokens)
+        data, outcome = parse_json_response(content)
+
+    # Réponse inexploitable : tous les champs sont considérés comme manquants
+    if data is None:
+        data = {}
+    missing = find_missing_fields(data, required_fields)
+    if missing:
+        # Relance ciblée : seuls les champs manquants sont redemandés
+        outcome = "reasked"
+        follow_up = list(messages)
+        if content:
+            follow_up.append({"role": "assistant", "content": content})
+        follow_up.append({"role": "user", "content": (
+            f"Il manque des champs ou ils sont invalides: {', '.join(missing)}. "
+            "Réponds uniquement avec un objet JSON contenant ces champs, au format demandé."
+        )})
+        try:
+            extra, _ = parse_json_response(_chat_json(model, follow_up, temperature, max_tokens))
+            if extra:
+                data.update({field: extra[field] for field in missing if field in extra})
+        except Exception as e:
+            print(f"Erreur lors de la relance Mistral ({call_name}): {e}")
+
+        # Compléter ce qui reste introuvable avec la structure de secours
+        still_missing = find_missing_fields(data, required_fields)
+        for field in still_missing:
+            data[field] = defaults[field]
+        if still_missing:
+            outcome = "fallback" if len(still_missing) == len(required_fields) else "partial_fallback"
+
+    record_route(call_name, routed_model, reason, time.perf_counter() - start, escalated)
+    record_parse_outcome(call_name, outcome)
+    return data
+
 def extract_visual_elements(raw_text):
     """
     Utilise Mistral pour extraire et enrichir les éléments visuels d'un rêve
     """
     
+    # Compacter les longues transcriptions (remplissage, phrases répétées)
+    dream_text = compact_transcript(raw_text)
+    
     # Prompt optimisé pour extraire les éléments visuels
     prompt = f"""
 Tu es un expert en analyse de rêves et en génération d'images. Analyse ce récit de rêve et extrais tous les éléments visuels importants pour créer une image détaillée.
 
 RÉCIT DU RÊVE:
-{raw_text}
+{dream_text}
 
 INSTRUCTIONS:
 1. Identifie les ÉLÉMENTS VISUELS principaux (personnages, objets, lieux, couleurs, lumière)
@@ -30,57 +184,39 @@ INSTRUCTIONS:
 5. Crée une DESCRIPTION OPTIMISÉE pour un générateur d'images
 
 FORMAT DE RÉPONSE (JSON):
-{{
-    "elements_visuels": {{
-        "personnages": ["description des personnages"],
-        "objets": ["liste des objets importants"],
-        "environnement": "description de l'environnement/lieu",
-        "couleurs": ["couleurs dominantes"],
-        "lumiere": "description de l'éclairage"
-    }},
-    "ambiance": {{
-        "emotion": "émotion principale (joyeux, anxieux, paisible, etc.)",
-        "atmosphere": "description de l'atmosphère",
-        "intensite": "faible/moyenne/forte"
-    }},
-    "style_recommande": "style artistique recommandé",
-    "prompt_optimise": "description complète et optimisée pour générateur d'images",
-    "mots_cles": ["mots-clés importants pour l'image"]
-}}
+{VISUAL_SCHEMA}
 
 Réponds uniquement en JSON valide, sans texte supplémentaire.
 """
 
+    # Dimensionner la réponse d'après le schéma attendu
+    max_tokens = max_tokens_for_schema(VISUAL_SCHEMA, dream_text, minimum=1500)
+    record_token_usage("extract_visual_elements", raw_text, dream_text, prompt, max_tokens)
+
+    # Structure basique si le JSON reste inexploitable
+    defaults = {
+        "elements_visuels": {"environnement": raw_text},
+        "ambiance": {"emotion": "neutre", "atmosphere": "indéterminée", "intensite": "moyenne"},
+        "style_recommande": "artistique",
+        "prompt_optimise": raw_text,
+        "mots_cles": raw_text.split()[:10]
+    }
+
     try:
         # Appel à l'API Mistral
-        response = client.chat.complete(
-            model="mistral-large-latest",
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
+        return _request_json(
+            "extract_visual_elements",
+            prompt,
+            VISUAL_REQUIRED_FIELDS,
+            defaults,
             temperature=0.3,  # Créativité modérée
-            max_tokens=1500
+            max_tokens=max_tokens,
+            text=dream_text
         )
-        
-        # Extraire le contenu de la réponse
-        content = response.choices[0].message.content
-        
-        # Parser le JSON
-        try:
-            processed_data = json.loads(content)
-            return processed_data
-        except json.JSONDecodeError:
-            # Si le JSON n'est pas valide, retourner une structure basique
-            return {
-                "elements_visuels": {"environnement": raw_text},
-                "ambiance": {"emotion": "neutre", "atmosphere": "indéterminée", "intensite": "moyenne"},
-                "style_recommande": "artistique",
-                "prompt_optimise": raw_text,
-                "mots_cles": raw_text.split()[:10]
-            }
             
     except Exception as e:
         print(f"Erreur lors du traitement avec Mistral: {e}")
+        record_parse_outcome("extract_visual_elements", "error")
         # Retourner une structure de base en cas d'erreur
         return {
             "elements_visuels": {"environnement": raw_text},
@@ -95,41 +231,43 @@ def analyze_dream_sentiment(raw_text):
     Analyse le sentiment et l'émotion du rêve avec Mistral
     """
     
+    dream_text = compact_transcript(raw_text)
+    
     prompt = f"""
 Analyse ce récit de rêve et détermine son sentiment émotionnel global.
 
-RÉCIT: {raw_text}
+RÉCIT: {dream_text}
 
 Réponds en JSON avec cette structure exacte:
-{{
-    "sentiment_global": "positif/neutre/négatif",
-    "emotions_principales": ["liste des émotions détectées"],
-    "niveau_stress": "faible/moyen/élevé",
-    "type_reve": "cauchemar/rêve paisible/rêve aventureux/rêve étrange/autre",
-    "recommandation_style": "style visuel recommandé basé sur l'émotion"
-}}
+{SENTIMENT_SCHEMA}
 """
 
+    max_tokens = max_tokens_for_schema(SENTIMENT_SCHEMA, minimum=500, maximum=1000)
+    record_token_usage("analyze_dream_sentiment", raw_text, dream_text, prompt, max_tokens)
+
+    defaults = {
+        "sentiment_global": "neutre",
+        "emotions_principales": ["indéterminé"],
+        "niveau_stress": "moyen",
+        "type_reve": "autre",
+        "recommandation_style": "artistique"
+    }
+
     try:
-        response = client.chat.complete(
-            model="mistral-large-latest",
-            messages=[{"role": "user", "content": prompt}],
+        return _request_json(
+            "analyze_dream_sentiment",
+            prompt,
+            SENTIMENT_REQUIRED_FIELDS,
+            defaults,
             temperature=0.1,  # Plus déterministe pour l'analyse
-            max_tokens=500
+            max_tokens=max_tokens,
+            text=dream_text
         )
         
-        content = response.choices[0].message.content
-        return json.loads(content)
-        
     except Exception as e:
         print(f"Erreur analyse sentiment: {e}")
-        return {
-            "sentiment_global": "neutre",
-            "emotions_principales": ["indéterminé"],
-            "niveau_stress": "moyen",
-            "type_reve": "autre",
-            "recommandation_style": "artistique"
-        }
+        record_parse_outcome("analyze_dream_sentiment", "error")
+        return dict(defaults)
 
 def create_image_prompt(processed_data, style_preference="automatique"):
     """
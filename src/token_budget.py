@@ -0,0 +1,151 @@
+import re
+import logging
+import threading
+
+# Approximation prudente : le français dépasse souvent 1 token pour 4 caractères
+CHARS_PER_TOKEN = 3
+
+# En dessous de ce seuil, la transcription est envoyée telle quelle
+COMPACTION_THRESHOLD_TOKENS = 300
+
+# Hésitations de l'oral (transcriptions Whisper), toujours sans contenu
+HESITATION_PATTERN = r"\b(?:euh+|heu+|hum+|hmm+)\b"
+# Marqueurs de discours : retirés seulement quand la ponctuation les isole
+# ("bah", "ben", "bref" ou "en fait" peuvent porter du sens dans une phrase)
+DISCOURSE_MARKER_PATTERN = r"\b(?:du coup|en fait|tu vois|vous voyez)\b"
+
+# Statistiques cumulées par appel (nom de la fonction -> compteurs)
+_token_stats = {}
+_token_stats_lock = threading.Lock()
+
+def estimate_tokens(text):
+    """
+    Estime le nombre de tokens d'un texte (heuristique caractères/mots)
+    """
+    if not text:
+        return 0
+    by_chars = len(text) / CHARS_PER_TOKEN
+    by_words = len(text.split()) * 1.3
+    return int(max(by_chars, by_words)) + 1
+
+def _capitalize_start(match):
+    # Le mot qui suit une suppression en début de phrase reprend la majuscule
+    return match.group(1) + (match.group(2) or "").upper()
+
+def _remove_fillers(text):
+    """
+    Supprime les hésitations et les marqueurs de discours isolés, avec leur ponctuation
+    """
+    flags = re.IGNORECASE
+    # "Hum." ou "Euh, heu..." en début de phrase : la phrase de remplissage disparaît entièrement
+    text = re.sub(rf"(^|[.!?]\s+)(?:{HESITATION_PATTERN}[\s,;.!?…]*)+(\w)?", _capitalize_start, text, flags=flags)
+    # ", euh," : les virgules ne marquent que la pause de l'hésitation
+    text = re.sub(rf",\s*{HESITATION_PATTERN}\s*,", "", text, flags=flags)
+    # Hésitation dans une phrase : retirer le mot et la virgule qui le suit éventuellement
+    text = re.sub(rf"\s*{HESITATION_PATTERN}[,;]?", "", text, flags=flags)
+
+    # "En fait, il..." en début de phrase
+    text = re.sub(rf"(^|[.!?]\s+){DISCOURSE_MARKER_PATTERN},\s*(\w)", _capitalize_start, text, flags=flags)
+    # ", du coup," au milieu d'une phrase ou ", tu vois." en fin de phrase
+    text = re.sub(rf",\s*{DISCOURSE_MARKER_PATTERN}\s*(?=[,.!?])", "", text, flags=flags)
+
+    # Nettoyer les espaces et la ponctuation laissés par la suppression
+    text = re.sub(r"\s+([,.!?])", r"\1", text)
+    text = re.sub(r",([.!?])", r"\1", text)
+    text = re.sub(r"^[,;\s]+", "", text)
+    text = re.sub(r"\s{2,}", " ", text)
+    return text.strip()
+
+def _deduplicate_sentences(text):
+    """
+    Supprime les phrases répétées (comparaison insensible à la casse et à la ponctuation)
+    """
+    sentences = re.split(r"(?<=[.!?])\s+", text)
+    seen = set()
+    kept = []
+    for sentence in sentences:
+        key = re.sub(r"[^\w\s]", "", sentence.lower())
+        key = " ".join(key.split())
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        kept.append(sentence)
+    return " ".join(kept)
+
+def compact_transcript(raw_text, threshold=COMPACTION_THRESHOLD_TOKENS):
+    """
+    Compacte une transcription longue sans toucher au contenu descriptif
+
+    Args:
+        raw_text (str): La transcription d'origine
+        threshold (int): Nombre de tokens à partir duquel on compacte
+
+    Returns:
+        str: La transcription compactée (ou inchangée si elle est courte)
+    """
+    if not raw_text or estimate_tokens(raw_text) <= threshold:
+        return raw_text
+
+    compacted = " ".join(raw_text.split())
+    compacted = _remove_fillers(compacted)
+    compacted = _deduplicate_sentences(compacted)
+
+    # Ne jamais renvoyer un texte vide à la place du récit
+    return compacted or raw_text
+
+def max_tokens_for_schema(schema, text="", expansion=3.0, text_ratio=0.75, minimum=200, maximum=4000):
+    """
+    Calcule max_tokens à partir du schéma JSON attendu et de la longueur du récit
+
+    max_tokens n'est qu'un plafond : une borne basse généreuse évite de tronquer
+    les réponses des récits riches (personnages, objets, prompt_optimise complet)
+
+    Args:
+        schema (str): Le gabarit JSON inclus dans le prompt
+        text (str): La transcription envoyée (la réponse grandit avec le récit)
+        expansion (float): Facteur appliqué pour les valeurs remplies par le modèle
+        text_ratio (float): Tokens de réponse prévus par token de transcription
+        minimum (int): Borne basse
+        maximum (int): Borne haute
+
+    Returns:
+        int: La valeur de max_tokens à demander
+    """
+    budget = int(estimate_tokens(schema) * expansion + estimate_tokens(text) * text_ratio)
+    return max(minimum, min(maximum, budget))
+
+def record_token_usage(call_name, original_text, compacted_text, prompt, max_tokens):
+    """
+    Enregistre les tokens économisés pour un appel et retourne le détail
+    """
+    original_tokens = estimate_tokens(original_text)
+    compacted_tokens = estimate_tokens(compacted_text)
+    saved = max(0, original_tokens - compacted_tokens)
+
+    usage = {
+        "transcript_tokens": original_tokens,
+        "compacted_tokens": compacted_tokens,
+        "tokens_saved": saved,
+        "prompt_tokens": estimate_tokens(prompt),
+        "max_tokens": max_tokens
+    }
+
+    with _token_stats_lock:
+        stats = _token_stats.setdefault(call_name, {"calls": 0, "tokens_saved": 0, "prompt_tokens": 0})
+        stats["calls"] += 1
+        stats["tokens_saved"] += saved
+        stats["prompt_tokens"] += usage["prompt_tokens"]
+        stats["last_call"] = usage
+
+    logging.info(
+        f"{call_name}: ~{usage['prompt_tokens']} tokens en entrée, "
+        f"{saved} tokens économisés, max_tokens={max_tokens}"
+    )
+    return usage
+
+def get_token_stats():
+    """
+    Retourne les statistiques cumulées de consommation de tokens
+    """
+    with _token_stats_lock:
+        return {name: dict(stats) for name, stats in _token_stats.items()}